@@ -48,6 +48,16 @@ seq_R2 :   ../dataset/C1_R4.fastq.gz  ../dataset/C2_R4.fastq.gz  ../dataset/C3_R
 index_R1 : ../dataset/C1_R2.fastq.gz  ../dataset/C2_R2.fastq.gz  ../dataset/C3_R2.fastq.gz
 index_R2 : ../dataset/C1_R3.fastq.gz  ../dataset/C2_R3.fastq.gz  ../dataset/C3_R3.fastq.gz
 
+# In watch mode (option -w) the files listed above are ignored and the chunks are discovered in the
+# watched directory. Files of a same chunk have the same name, except for a read tag (R1 to R4, I1
+# or I2) such as C1_R2.fastq.gz or Run_L001_I1_001.fastq.gz. By default the usual conventions
+# above are used depending on the index2 option. Otherwise uncomment the following options and
+# indicate the tag of each category, for example for bcl2fastq named files (STRING)
+#seq_R1_tag : R1
+#seq_R2_tag : R2
+#index_R1_tag : I1
+#index_R2_tag : I2
+
 ###################################################################################################
 [index]
 
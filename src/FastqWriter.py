@@ -71,7 +71,6 @@ class FastqWriter (object):
         # Flush the buffers each time they reach the size of the max buffer size
         if self.counter == self.buffer_size:
             self.flush_buffers ()
-            self.counter = 0
 
     def init_files (self):
         """Init empty files for R1 and R2.fastq.gz"""
@@ -81,10 +80,11 @@ class FastqWriter (object):
             print("\tCreate {} file".format(self.R2_fastq_name))
 
     def flush_buffers (self):
-        """Append to R1 and R2 fastq.gz files"""
+        """Append to R1 and R2 fastq.gz files and reset the sequence counter"""
         with gopen (self.R1_fastq_name, "ab") as fastq_file:
             fastq_file.write(self.R1_buffer)
             self.R1_buffer = ""
         with gopen (self.R2_fastq_name, "ab") as fastq_file:
             fastq_file.write(self.R2_buffer)
             self.R2_buffer = ""
+        self.counter = 0
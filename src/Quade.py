@@ -19,7 +19,11 @@ try:
     import optparse
     import sys
     import os
-    from time import time
+    import re
+    import struct
+    import zlib
+    from gzip import GzipFile
+    from time import time, sleep
     from datetime import datetime
 
     # Local imports
@@ -43,7 +47,13 @@ class Quade(object):
     #~~~~~~~CLASS FIELDS~~~~~~~#
 
     VERSION = "Quade 0.3.2"
-    USAGE = "Usage: %prog -c Conf.txt [-i -h]"
+    USAGE = "Usage: %prog -c Conf.txt [-w Watch_dir -p 60 -t 3600 -i -h]"
+    # Pattern of chunk files in watch mode, for example C1_R2.fastq.gz or Run_L001_I1_001.fastq.gz.
+    # Files sharing the same name once the read tag is removed belong to the same chunk
+    WATCH_PATTERN = re.compile(r"^(?P<prefix>.+)_(?P<tag>R[1-4]|I[12])(?P<suffix>(_\d+)?\.f(ast)?q\.gz)$")
+    # Default read tags of the fastq categories in watch mode, following the CASAVA convention
+    SIMPLE_INDEX_TAGS = {"seq_R1":"R1", "index_R1":"R2", "seq_R2":"R3"}
+    DOUBLE_INDEX_TAGS = {"seq_R1":"R1", "index_R1":"R2", "index_R2":"R3", "seq_R2":"R4"}
 
     #~~~~~~~CLASS METHODS~~~~~~~#
 
@@ -59,15 +69,21 @@ class Quade(object):
             help= "Path to the configuration file [Mandatory]")
         optparser.add_option('-i', dest="init_conf", action='store_true',
             help= "Generate an example configuration file and exit [Facultative]")
+        optparser.add_option('-w', dest="watch_dir",
+            help= "Directory to watch for new fastq chunks instead of the fastq section files [Facultative]")
+        optparser.add_option('-p', dest="poll", type="int",
+            help= "Delay in seconds between 2 scans of the watched directory (default 60) [Facultative]")
+        optparser.add_option('-t', dest="timeout", type="int",
+            help= "Stop watching after this delay in seconds without new chunk or file change (default 3600) [Facultative]")
 
         # Parse arguments
         options, args = optparser.parse_args()
 
-        return Quade(options.conf_file, options.init_conf)
+        return Quade(options.conf_file, options.init_conf, options.watch_dir, options.poll, options.timeout)
 
     #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
 
-    def __init__(self, conf_file=None, init_conf=None):
+    def __init__(self, conf_file=None, init_conf=None, watch_dir=None, poll=None, timeout=None):
         """
         Initialization function, parse options from configuration file and verify their values.
         All self.variables are initialized explicitly in init.
@@ -88,6 +104,20 @@ class Quade(object):
             self._is_readable_file(conf_file)
             self.conf = conf_file
 
+            # Watch mode options, polling delay and timeout are only meaningful with a watched directory
+            assert watch_dir or (poll is None and timeout is None), "-p and -t options require -w"
+            self.watch_dir = watch_dir
+            self.poll = 60 if poll is None else poll
+            self.timeout = 3600 if timeout is None else timeout
+            # Chunks found incomplete in the watched directory with their missing tags
+            self.incomplete = {}
+            # Chunks not parsed because of an incomplete gzip file, with this file and its size
+            self.invalid = {}
+            # Time of the last new or growing file in the watched directory
+            self.last_activity = None
+            # Chunk being parsed in watch mode, to report an interruption in the middle of a chunk
+            self.partial_chunk = None
+
             # Define a configuration file parser object and load the configuration file
             cp = ConfigParser.RawConfigParser(allow_no_value=True)
             cp.read(self.conf)
@@ -115,11 +145,22 @@ class Quade(object):
                 "start":0 if not self.mol2 else cp.getint("index", "molecular2_start")-1,
                 "end":0 if not self.mol2 else cp.getint("index", "molecular2_end")}
 
-            # List of fastq files
-            self.seq_R1 = cp.get("fastq", "seq_R1").split()
-            self.seq_R2 = cp.get("fastq", "seq_R2").split()
-            self.index_R1 = cp.get("fastq", "index_R1").split()
-            self.index_R2 = [] if not self.idx2 else cp.get("fastq", "index_R2").split()
+            # List of fastq files. In watch mode the chunks are discovered in the watched directory
+            # and the fastq categories are identified by the read tag in the file names
+            if self.watch_dir:
+                self.seq_R1 = self.seq_R2 = self.index_R1 = self.index_R2 = []
+                default_tags = self.DOUBLE_INDEX_TAGS if self.idx2 else self.SIMPLE_INDEX_TAGS
+                self.watch_tags = {}
+                for cat, tag in default_tags.items():
+                    if cp.has_option("fastq", cat+"_tag"):
+                        tag = cp.get("fastq", cat+"_tag")
+                    self.watch_tags[cat] = tag
+            else:
+                self.seq_R1 = cp.get("fastq", "seq_R1").split()
+                self.seq_R2 = cp.get("fastq", "seq_R2").split()
+                self.index_R1 = cp.get("fastq", "index_R1").split()
+                self.index_R2 = [] if not self.idx2 else cp.get("fastq", "index_R2").split()
+                self.watch_tags = {}
 
             # Init the class Sample with generic values (unconventional initialization)
             Sample.CLASS_INIT(
@@ -171,26 +212,99 @@ class Quade(object):
 
         start_time = time()
 
-        print ("Start parsing files: {} chunks to be parsed".format(len(self.seq_R1)))
-        # For double indexing
-        if self.idx2:
-            self.double_index_parser()
-        # For simple indexing
+        # Demultiplex the chunks as soon as they are written in the watched directory
+        if self.watch_dir:
+            print ("Start watching {} for new chunks".format(self.watch_dir))
+            self.watch_parser()
         else:
-            self.simple_index_parser()
+            print ("Start parsing files: {} chunks to be parsed".format(len(self.seq_R1)))
+            # For double indexing
+            if self.idx2:
+                self.double_index_parser()
+            # For simple indexing
+            else:
+                self.simple_index_parser()
 
         # Flush remaining content in sample buffers
         Sample.FLUSH_ALL()
 
         # Write a report
         print ("Generate_a csv report")
+        self.write_report()
+
+        print ("Done in {}s".format(round(time()-start_time, 3)))
+        return(0)
+
+    def write_report (self):
+        """ Write a csv report with the current values of the Sample counters """
         with open ("Quade_report.csv", "wb") as report:
             report.write ("Program {}\tDate {}\n\n".format(self.VERSION,str(datetime.today())))
+            if self.partial_chunk:
+                report.write ("Warning\tChunk {} was interrupted and only partially parsed\n\n".format(self.partial_chunk))
+            for key, missing in sorted(self.incomplete.items()):
+                report.write ("Warning\tChunk {} not parsed, missing tags {}\n\n".format(key, " ".join(missing)))
+            for key, (fp, size) in sorted(self.invalid.items()):
+                report.write ("Warning\tChunk {} not parsed, {} is not a complete gzip file\n\n".format(key, fp))
             for descr, value in Sample.REPORT():
                 report.write ("{}\t{}\n".format(descr, value))
 
-        print ("Done in {}s".format(round(time()-start_time, 3)))
-        return(0)
+    def watch_parser (self):
+        """
+        Poll the watched directory and demultiplex each chunk as soon as all its files are complete.
+        Outputs are appended and the report is updated after each chunk. Stop when no new chunk was
+        found and no file changed during timeout seconds or on keyboard interruption. Return the
+        number of chunks parsed
+        """
+        done = set()
+        sizes = {}
+        self.last_activity = time()
+        n = 0
+
+        try:
+            while True:
+                parsed = False
+
+                for key, files in self._find_stable_chunks(done, sizes):
+
+                    # Validate each chunk just before parsing it, not to delay the first one
+                    if not self._is_valid_chunk(key, files, sizes):
+                        continue
+
+                    print("Start parsing chunk {} ({})".format(n+1, key))
+                    self.partial_chunk = key
+                    if self.idx2:
+                        self.double_index_chunk(files["seq_R1"], files["seq_R2"], files["index_R1"], files["index_R2"])
+                    else:
+                        self.simple_index_chunk(files["seq_R1"], files["seq_R2"], files["index_R1"])
+                    self.partial_chunk = None
+                    n += 1
+                    print("\tEnd of chunk {}".format(n))
+
+                    # Make the results of the chunk available right away
+                    done.add(key)
+                    Sample.FLUSH_ALL()
+                    self.write_report()
+                    self.last_activity = time()
+                    parsed = True
+
+                if not parsed:
+                    if time()-self.last_activity > self.timeout:
+                        print("No new chunk or file change since {}s, stop watching".format(self.timeout))
+                        for key, missing in sorted(self.incomplete.items()):
+                            print("\tChunk {} never completed, missing tags {}".format(key, " ".join(missing)))
+                        for key, (fp, size) in sorted(self.invalid.items()):
+                            print("\tChunk {} never parsed, {} is not a complete gzip file".format(key, fp))
+                        break
+                    sleep(self.poll)
+
+        except KeyboardInterrupt:
+            if self.partial_chunk:
+                print("Watching interrupted by user while parsing chunk {}, after {} complete chunks. "\
+                "Outputs and report contain a partial chunk".format(self.partial_chunk, n))
+            else:
+                print("Watching interrupted by user after {} chunks".format(n))
+
+        return n
 
     def double_index_parser (self):
 
@@ -198,30 +312,35 @@ class Quade(object):
         for n, (R1, R2, I1, I2) in enumerate (zip (self.seq_R1, self.seq_R2, self.index_R1, self.index_R2)):
 
             print("Start parsing chunk {}".format(n+1))
+            self.double_index_chunk(R1, R2, I1, I2)
+            print("\tEnd of chunk {}".format(n+1))
 
-            # Init FastqReader generators
-            R1_gen = FastqReader(R1)
-            R2_gen = FastqReader(R2)
-            I1_gen = FastqReader(I1)
-            I2_gen = FastqReader(I2)
+    def double_index_chunk (self, R1, R2, I1, I2):
+        """ Demultiplex a single chunk of double indexed fastq files """
 
-            # Iterate over read in fastq files until it is exhaust
-            try:
-                while True:
-                    read1 = R1_gen.next()
-                    read2 = R2_gen.next()
-                    index1 = I1_gen.next()
-                    index2 = I2_gen.next()
+        # Init FastqReader generators
+        R1_gen = FastqReader(R1)
+        R2_gen = FastqReader(R2)
+        I1_gen = FastqReader(I1)
+        I2_gen = FastqReader(I2)
 
-                    # Extract index and molecular sequences from index reads an
-                    index =     index1[self.idx1_pos["start"]:self.idx1_pos["end"]]+index2[self.idx2_pos["start"]:self.idx2_pos["end"]]
-                    molecular = index1[self.mol1_pos["start"]:self.mol1_pos["end"]]+index2[self.mol2_pos["start"]:self.mol2_pos["end"]]
+        # Iterate over read in fastq files until it is exhaust
+        try:
+            while True:
+                read1 = R1_gen.next()
+                read2 = R2_gen.next()
+                index1 = I1_gen.next()
+                index2 = I2_gen.next()
+
+                # Extract index and molecular sequences from index reads an
+                index =     index1[self.idx1_pos["start"]:self.idx1_pos["end"]]+index2[self.idx2_pos["start"]:self.idx2_pos["end"]]
+                molecular = index1[self.mol1_pos["start"]:self.mol1_pos["end"]]+index2[self.mol2_pos["start"]:self.mol2_pos["end"]]
 
-                    # Identify sample and verify index quality
-                    Sample.FINDER (read1,read2, index, molecular)
+                # Identify sample and verify index quality
+                Sample.FINDER (read1,read2, index, molecular)
 
-            except StopIteration as E:
-                print("\tEnd of chunk {}".format(n+1))
+        except StopIteration as E:
+            pass
 
     def simple_index_parser (self):
 
@@ -229,29 +348,33 @@ class Quade(object):
         for n, (R1, R2, I1) in enumerate (zip(self.seq_R1, self.seq_R2, self.index_R1)):
 
             print("Start parsing chunk {}/{}".format(n+1, len(self.seq_R1)))
+            self.simple_index_chunk(R1, R2, I1)
+            print("\tEnd of chunk {}".format(n+1))
+
+    def simple_index_chunk (self, R1, R2, I1):
+        """ Demultiplex a single chunk of simple indexed fastq files """
 
-            # Init FastqReader generators
-            R1_gen = FastqReader(R1)
-            R2_gen = FastqReader(R2)
-            I1_gen = FastqReader(I1)
+        # Init FastqReader generators
+        R1_gen = FastqReader(R1)
+        R2_gen = FastqReader(R2)
+        I1_gen = FastqReader(I1)
 
-            # Iterate over reads in fastq files until exhaustion
-            try:
-                while True:
-                    read1 = R1_gen.next()
-                    read2 = R2_gen.next()
-                    index1 = I1_gen.next()
+        # Iterate over reads in fastq files until exhaustion
+        try:
+            while True:
+                read1 = R1_gen.next()
+                read2 = R2_gen.next()
+                index1 = I1_gen.next()
 
-                    # Extract index and molecular sequences from index reads
-                    index =     index1[self.idx1_pos["start"]:self.idx1_pos["end"]]
-                    molecular = index1.seq[self.mol1_pos["start"]:self.mol1_pos["end"]]
+                # Extract index and molecular sequences from index reads
+                index =     index1[self.idx1_pos["start"]:self.idx1_pos["end"]]
+                molecular = index1.seq[self.mol1_pos["start"]:self.mol1_pos["end"]]
 
-                    # Identify sample and verify index quality
-                    Sample.FINDER (read1,read2, index, molecular)
+                # Identify sample and verify index quality
+                Sample.FINDER (read1,read2, index, molecular)
 
-            except StopIteration as E:
-                print(E)
-                print("\tEnd of chunk {}".format(n+1))
+        except StopIteration as E:
+            print(E)
 
     #~~~~~~~PRIVATE METHODS~~~~~~~#
 
@@ -261,8 +384,20 @@ class Quade(object):
         # Verify values from the quality section
         assert 0 <= self.minimal_qual <= 40, "Authorized values for minimal_qual : 0 to 40"
 
+        # Verify the watched directory, fastq files are discovered during the run
+        if self.watch_dir:
+            assert os.path.isdir(self.watch_dir) and os.access(self.watch_dir, os.R_OK),\
+            "{} is not a readable directory".format(self.watch_dir)
+            assert os.path.realpath(self.watch_dir) != os.path.realpath(os.getcwd()),\
+            "The watched directory cannot be the current directory where fastq files are created"
+            assert self.poll > 0, "The polling delay has to be a positive number of seconds"
+            assert self.timeout >= self.poll, "The timeout has to be greater or equal to the polling delay"
+            for cat, tag in self.watch_tags.items():
+                assert re.match(r"^(R[1-4]|I[12])$", tag), "{}_tag has to be one of R1 to R4, I1 or I2".format(cat)
+            assert len(set(self.watch_tags.values())) == len(self.watch_tags), "fastq tags have to be unique"
+
         # Verify values of the fastq section and readability of fastq files
-        if self.idx2:
+        elif self.idx2:
             assert len(self.seq_R1) == len(self.seq_R2) == len(self.index_R1) == len(self.index_R2) > 0,\
             "seq_R1, seq_R2, index_R1 and index_R2 are mandatory and have to contain the same number of files"
             for fp in (self.seq_R1 + self.seq_R2 + self.index_R1 + self.index_R2):
@@ -278,6 +413,83 @@ class Quade(object):
             assert pos["start"] >= 0
             assert pos["end"] >= pos["start"]
 
+    def _find_stable_chunks (self, done, sizes):
+        """
+        Scan the watched directory and return a sorted list of (key, files) for the chunks not yet
+        parsed, whose files are all present with a size unchanged since the previous scan. sizes is
+        updated with the size of every file and the idle timer is reset if a file is new or growing
+        """
+        # Group the files of the watched directory by chunk and record their sizes. Files can be
+        # renamed or removed by the sequencer since the directory was listed
+        chunk_dict = {}
+        prev_sizes = dict(sizes)
+        for fn in os.listdir(self.watch_dir):
+            m = self.WATCH_PATTERN.match(fn)
+            if m:
+                key = m.group("prefix")+m.group("suffix")
+                if key in done:
+                    continue
+                fp = os.path.join(self.watch_dir, fn)
+                try:
+                    sizes[fp] = os.path.getsize(fp)
+                except OSError:
+                    sizes.pop(fp, None)
+                    continue
+                if prev_sizes.get(fp) != sizes[fp]:
+                    self.last_activity = time()
+                chunk_dict.setdefault(key, {})[m.group("tag")] = fp
+
+        # Forget the chunks whose files all disappeared from the watched directory
+        for key in [k for k in self.incomplete.keys()+self.invalid.keys() if k not in chunk_dict]:
+            self.incomplete.pop(key, None)
+            self.invalid.pop(key, None)
+
+        chunks = []
+
+        for key in sorted(chunk_dict):
+
+            # Verify that all the files of the chunk were created, report missing files only once
+            tags = chunk_dict[key]
+            missing = sorted(tag for tag in self.watch_tags.values() if tag not in tags)
+            if missing:
+                if self.incomplete.get(key) != missing:
+                    print("\tChunk {} incomplete, waiting for tags {}".format(key, " ".join(missing)))
+                self.incomplete[key] = missing
+                continue
+            self.incomplete.pop(key, None)
+            files = {cat:tags[tag] for cat, tag in self.watch_tags.items()}
+
+            # Verify that the files are not growing anymore
+            if all(sizes[fp] > 0 and prev_sizes.get(fp) == sizes[fp] for fp in files.values()):
+                chunks.append((key, files))
+
+        return chunks
+
+    def _is_valid_chunk (self, key, files, sizes):
+        """
+        Verify the gzip trailer of all the files of a chunk. A file failing the check is stored in
+        self.invalid with its size, so that it is not decompressed again until its size changes
+        """
+        for fp in files.values():
+            if self.invalid.get(key) == (fp, sizes[fp]):
+                return False
+            if not self._is_complete_gzip(fp):
+                print("\t{} is not a complete gzip file, waiting for a change of size".format(fp))
+                self.invalid[key] = (fp, sizes[fp])
+                return False
+        self.invalid.pop(key, None)
+        return True
+
+    def _is_complete_gzip (self, fp):
+        """ Decompress a gzip file to verify that it ends with a valid trailer (CRC and size) """
+        try:
+            with GzipFile(fp, "rb") as gz:
+                while gz.read(1048576):
+                    pass
+            return True
+        except (IOError, OSError, EOFError, struct.error, zlib.error):
+            return False
+
     def _is_readable_file (self, fp):
         """ Verify the readability of a file or list of file """
         if not os.access(fp, os.R_OK):
@@ -0,0 +1,189 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+@package    Quade
+@brief      Check the watch mode with the test dataset. The chunk discovery is checked with an
+incomplete chunk (C2) and a truncated gzip file (C3), then the full watch mode is compared with the
+batch mode and interrupted in the middle of a chunk. Run from the test folder with:
+python check_watch.py
+@copyright  [GNU General Public License v2](http://www.gnu.org/licenses/gpl-2.0.html)
+@author     Adrien Leger - 2014
+* <adrien.leger@gmail.com>
+* <adrien.leger@inserm.fr>
+* <adrien.leger@univ-nantes.fr>
+* [Github](https://github.com/a-slide)
+* [Atlantic Gene Therapies - INSERM 1089] (http://www.atlantic-gene-therapies.fr/)
+"""
+
+# Standard library imports
+import sys
+import os
+import shutil
+import tempfile
+from gzip import open as gopen
+
+# Local imports
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, "..", "src"))
+from Quade import Quade
+from Sample import Sample
+from FastqWriter import FastqWriter
+
+DATASET = os.path.join(TEST_DIR, "dataset")
+CONF = os.path.join(TEST_DIR, "result", "Quade_conf_file.txt")
+CHUNKS = ["C1", "C2", "C3"]
+TAGS = ["R1", "R2", "R3", "R4"]
+
+def copy_chunk (watch_dir, chunk, tags):
+    for tag in tags:
+        shutil.copy(os.path.join(DATASET, "{}_{}.fastq.gz".format(chunk, tag)), watch_dir)
+
+def scan (quade, done, sizes):
+    return [key for key, files in quade._find_stable_chunks(done, sizes)]
+
+def reset_samples ():
+    """Reset the Sample class fields to be able to init Quade several times"""
+    Sample.TOTAL = Sample.FAIL_QUAL = Sample.PASS_QUAL = Sample.UNDETERMINED = 0
+    Sample.NAME_TO_SAMPLE.clear()
+    Sample.INDEX_TO_SAMPLE.clear()
+    del Sample.SAMPLE_LIST[:]
+    Sample.UNDETERMINED_WRITER = FastqWriter(name="Undetermined")
+
+def counters ():
+    return [Sample.TOTAL, Sample.PASS_QUAL, Sample.FAIL_QUAL, Sample.UNDETERMINED]
+
+def outputs (out_dir):
+    """Decompressed content of all the fastq files of a directory"""
+    content = {}
+    for fn in sorted(os.listdir(out_dir)):
+        if fn.endswith(".fastq.gz"):
+            with gopen(os.path.join(out_dir, fn), "rb") as fastq:
+                content[fn] = fastq.read()
+    return content
+
+def check_discovery (watch_dir):
+    """Grouping, completeness, stability and gzip trailer of chunks"""
+    quade = Quade(conf_file=CONF, watch_dir=watch_dir, poll=1, timeout=1)
+    done = set()
+    sizes = {}
+
+    # C1 complete, C2 without R4, C3 with a truncated R3
+    copy_chunk(watch_dir, "C1", TAGS)
+    copy_chunk(watch_dir, "C2", ["R1", "R2", "R3"])
+    copy_chunk(watch_dir, "C3", ["R1", "R2", "R4"])
+    with open(os.path.join(DATASET, "C3_R3.fastq.gz"), "rb") as src:
+        data = src.read()
+    with open(os.path.join(watch_dir, "C3_R3.fastq.gz"), "wb") as dest:
+        dest.write(data[:-10])
+
+    # Files are only considered stable from the second scan
+    assert scan(quade, done, sizes) == []
+    assert quade.incomplete == {"C2.fastq.gz":["R4"]}
+    chunks = dict(quade._find_stable_chunks(done, sizes))
+    assert sorted(chunks) == ["C1.fastq.gz", "C3.fastq.gz"]
+
+    # CASAVA convention for double indexing
+    files = chunks["C1.fastq.gz"]
+    for cat, tag in [("seq_R1","R1"), ("index_R1","R2"), ("index_R2","R3"), ("seq_R2","R4")]:
+        assert files[cat] == os.path.join(watch_dir, "C1_{}.fastq.gz".format(tag))
+
+    # The truncated file is rejected and not decompressed again while its size does not change
+    assert quade._is_valid_chunk("C1.fastq.gz", chunks["C1.fastq.gz"], sizes)
+    assert not quade._is_valid_chunk("C3.fastq.gz", chunks["C3.fastq.gz"], sizes)
+    assert quade.invalid == {"C3.fastq.gz":(os.path.join(watch_dir, "C3_R3.fastq.gz"), len(data)-10)}
+    done.add("C1.fastq.gz")
+
+    # C2 and C3 are completed and become available after 2 scans
+    copy_chunk(watch_dir, "C2", ["R4"])
+    copy_chunk(watch_dir, "C3", ["R3"])
+    assert scan(quade, done, sizes) == []
+    assert quade.incomplete == {}
+    chunks = dict(quade._find_stable_chunks(done, sizes))
+    assert sorted(chunks) == ["C2.fastq.gz", "C3.fastq.gz"]
+    assert quade._is_valid_chunk("C2.fastq.gz", chunks["C2.fastq.gz"], sizes)
+    assert quade._is_valid_chunk("C3.fastq.gz", chunks["C3.fastq.gz"], sizes)
+    assert quade.invalid == {}
+
+    # Removed files are skipped without error
+    os.remove(os.path.join(watch_dir, "C2_R1.fastq.gz"))
+    assert scan(quade, done, sizes) == ["C3.fastq.gz"]
+
+def check_watch_parser (watch_dir):
+    """Watch mode has to give the same counters and outputs as the batch mode"""
+
+    # Batch mode, run from a sub folder of test, as the fastq paths of the conf file are relative
+    os.chdir(tempfile.mkdtemp(dir=TEST_DIR))
+    Quade(conf_file=CONF)()
+    batch_counters = counters()
+    batch_outputs = outputs(os.getcwd())
+
+    # Watch mode on the same chunks
+    reset_samples()
+    for chunk in CHUNKS:
+        copy_chunk(watch_dir, chunk, TAGS)
+    os.chdir(tempfile.mkdtemp(dir=TEST_DIR))
+    quade = Quade(conf_file=CONF, watch_dir=watch_dir, poll=1, timeout=1)
+    assert quade.watch_parser() == 3
+    Sample.FLUSH_ALL()
+    quade.write_report()
+
+    assert batch_counters[0] > 0
+    assert counters() == batch_counters
+    assert outputs(os.getcwd()) == batch_outputs
+    with open("Quade_report.csv", "rb") as report:
+        assert "Warning" not in report.read()
+
+def check_interrupt (watch_dir):
+    """An interruption in the middle of a chunk has to be reported"""
+    for chunk in CHUNKS:
+        copy_chunk(watch_dir, chunk, TAGS)
+    os.chdir(tempfile.mkdtemp(dir=TEST_DIR))
+    quade = Quade(conf_file=CONF, watch_dir=watch_dir, poll=1, timeout=1)
+
+    # Interrupt the parsing of the second chunk
+    parse_chunk = quade.double_index_chunk
+    def interrupted_chunk (R1, R2, I1, I2):
+        if "C2" in R1:
+            raise KeyboardInterrupt
+        parse_chunk(R1, R2, I1, I2)
+    quade.double_index_chunk = interrupted_chunk
+
+    assert quade.watch_parser() == 1
+    assert quade.partial_chunk == "C2.fastq.gz"
+    quade.write_report()
+    with open("Quade_report.csv", "rb") as report:
+        assert "Chunk C2.fastq.gz was interrupted" in report.read()
+
+def check_timeout (watch_dir):
+    """The timeout cannot be shorter than the polling delay"""
+    try:
+        Quade(conf_file=CONF, watch_dir=watch_dir, poll=2, timeout=1)
+    except SystemExit as E:
+        assert E.code == 1
+    else:
+        raise AssertionError("A timeout shorter than the polling delay was accepted")
+
+def main ():
+    for check in [check_discovery, check_watch_parser, check_interrupt, check_timeout]:
+        print ("\n{}".format(check.__doc__))
+        start_dir = os.getcwd()
+        watch_dir = tempfile.mkdtemp()
+        try:
+            reset_samples()
+            check(watch_dir)
+        finally:
+            os.chdir(start_dir)
+            shutil.rmtree(watch_dir)
+            for fn in os.listdir(TEST_DIR):
+                if fn.startswith("tmp"):
+                    shutil.rmtree(os.path.join(TEST_DIR, fn))
+
+    print ("\nWatch mode checks OK")
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+#   TOP LEVEL INSTRUCTIONS
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+if __name__ == '__main__':
+    main()